@@ -8,21 +8,40 @@ Step 0: Prerequisites
 → End
 
 Checkpointing:
-- Saves progress after each step in ../logs/step_assistant/saves/<procedure_id>.json
+- Tracks progress after each step; ../logs/step_assistant/saves/<procedure_id>.json
+  is rewritten atomically every SAVE_FLUSH_INTERVAL seconds, after each subprocedure
+  and on exit / SIGTERM / SIGHUP (terminal closed)
 - Only one save per procedure
 - Resume restores next unconfirmed step
 """
 
+import atexit
 import json
 import os
+import re
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 from input_to_procedure import ProcedureRetriever
 from user_input_handler import UserInputHandler
+from utils import load_json
 
 
 SAVE_DIR = "../logs/step_assistant/saves/"
+SAVE_READ_WORKERS = 8
+SAVE_FLUSH_INTERVAL = 30  # seconds between background checkpoint flushes
+# Signals that end the session without running atexit hooks by default (no SIGHUP on Windows)
+CHECKPOINT_SIGNALS = [getattr(signal, name) for name in ("SIGTERM", "SIGHUP") if hasattr(signal, name)]
+
+# The whole answer, minus punctuation, must be a confirmation ("yes", "Yes.", "ok yes",
+# "yes, done") or a bare "y": any other word ("no yes", "y'know, not done", "yesterday") rejects it
+AFFIRMATIVE_WORDS = frozenset({"yes", "yeah", "yep", "yup", "confirmed"})
+CONFIRMATION_FILLER_WORDS = frozenset({"ok", "okay", "alright", "done", "finished", "i'm", "it's"})
+WORD_PATTERN = re.compile(r"[a-z']+")
 os.makedirs(SAVE_DIR, exist_ok=True)
 
 
@@ -56,14 +75,26 @@ class StepManager:
         # Save path
         self.save_path = Path(SAVE_DIR) / f"{self.procedure_id}.json"
 
+        # Checkpoint: updated in memory per step, flushed to disk only when dirty
+        self._state_snapshot: Optional[dict] = None
+        self._dirty = False
+        self._save_lock = threading.Lock()
+        self._stop_flushing = threading.Event()
+        self._previous_handlers = {}
+
     # -------------------------
     # Public entry point
     # -------------------------
 
     def run(self) -> None:
-        self._print_header()
-        self._run_prerequisites()
-        self._run_subprocedures()
+        self._start_checkpointing()
+        try:
+            self._print_header()
+            self._run_prerequisites()
+            self._run_subprocedures()
+        finally:
+            # Persists the last confirmed step, also when leaving early
+            self._stop_checkpointing()
         self._print_footer()
         # Clear save after completion
         if self.save_path.exists():
@@ -74,40 +105,100 @@ class StepManager:
     # Internal helpers
     # -------------------------
 
+    def _start_checkpointing(self) -> None:
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+        atexit.register(self._flush_state)
+        # SIGTERM / SIGHUP → SystemExit, so run()'s finally block flushes the save
+        if threading.current_thread() is threading.main_thread():
+            for signum in CHECKPOINT_SIGNALS:
+                self._previous_handlers[signum] = signal.signal(signum, self._handle_signal)
+
+    def _stop_checkpointing(self) -> None:
+        self._stop_flushing.set()
+        self._flush_state()
+        atexit.unregister(self._flush_state)
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+        self._previous_handlers = {}
+
+    def _handle_signal(self, signum, frame) -> None:
+        raise SystemExit(128 + signum)
+
+    def _flush_periodically(self) -> None:
+        while not self._stop_flushing.wait(SAVE_FLUSH_INTERVAL):
+            self._flush_state()
+
     def _save_state(self) -> None:
-        state = {
-            "procedure_id": self.procedure_id,
-            "procedure_title": self.procedure_title,
-            "subprocedure_idx": self.current_subprocedure_idx,
-            "step_idx": self.current_step_idx,
-        }
-        with open(self.save_path, "w", encoding="utf-8") as f:
+        """
+        Records the latest confirmed position; the disk write is deferred.
+        """
+        with self._save_lock:
+            self._state_snapshot = {
+                "procedure_id": self.procedure_id,
+                "procedure_title": self.procedure_title,
+                "subprocedure_idx": self.current_subprocedure_idx,
+                "step_idx": self.current_step_idx,
+            }
+            self._dirty = True
+
+    def _flush_state(self) -> None:
+        """
+        Writes the snapshot if it changed since the last flush.
+        """
+        with self._save_lock:
+            if not self._dirty:
+                return
+            self._write_state(self._state_snapshot)
+            self._dirty = False
+
+    def _write_state(self, state: dict) -> None:
+        """
+        Atomically replaces the save file (tmp file + rename), so a crash
+        mid-write never leaves a truncated save behind.
+        """
+        tmp_path = self.save_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.save_path)
 
     def _require_yes(self, prompt: str) -> None:
         """
         Blocks execution until the user explicitly confirms.
         Uses the shared UserInputHandler (text / voice).
-        Saves progress after each confirmation.
+        Records progress after each confirmation.
         """
         while True:
             answer = self.input_handler.get_input(f"{prompt}:").strip().lower()
-            if "yes" in answer or answer == "y":
+            words = set(WORD_PATTERN.findall(answer))
+            if answer == "y" or (
+                words & AFFIRMATIVE_WORDS and words <= AFFIRMATIVE_WORDS | CONFIRMATION_FILLER_WORDS
+            ):
                 self._save_state()
                 return
             print("❌ Please explicitly confirm by typing or saying 'yes'.")
 
+    def _write_block(self, lines: List[str]) -> None:
+        """
+        Emits a block of output lines with a single stdout write.
+        """
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
     def _print_header(self) -> None:
-        print("\n" + "=" * 80)
-        print("📘 PROCEDURE START")
-        print("=" * 80)
-        print("\nTitle:", self.procedure.get("title"))
-        print("URL:", self.procedure.get("full_url"))
+        self._write_block([
+            "\n" + "=" * 80,
+            "📘 PROCEDURE START",
+            "=" * 80,
+            f"\nTitle: {self.procedure.get('title')}",
+            f"URL: {self.procedure.get('full_url')}",
+        ])
 
     def _print_footer(self) -> None:
-        print("\n" + "=" * 80)
-        print("✅ PROCEDURE COMPLETE")
-        print("=" * 80)
+        self._write_block([
+            "\n" + "=" * 80,
+            "✅ PROCEDURE COMPLETE",
+            "=" * 80,
+        ])
 
     # -------------------------
     # Step 0 — Prerequisites
@@ -118,9 +209,9 @@ class StepManager:
         if not prerequisites:
             return
 
-        print("\n--- STEP 0: PREREQUISITES ---")
-        for i, item in enumerate(prerequisites, 1):
-            print(f"{i}. {item}")
+        lines = ["\n--- STEP 0: PREREQUISITES ---"]
+        lines.extend(f"{i}. {item}" for i, item in enumerate(prerequisites, 1))
+        self._write_block(lines)
 
         self._require_yes("Have all prerequisites been reviewed and satisfied")
 
@@ -138,9 +229,11 @@ class StepManager:
         section_title = section.get("section_title", f"Section {section_idx}")
         steps = section.get("steps", [])
 
-        print("\n" + "=" * 50)
-        print(f"🔧 SUBPROCEDURE: {section_title}")
-        print("=" * 50)
+        self._write_block([
+            "\n" + "=" * 50,
+            f"🔧 SUBPROCEDURE: {section_title}",
+            "=" * 50,
+        ])
 
         # Resume from saved step index
         start_step = self.current_step_idx if section_idx == self.current_subprocedure_idx else 0
@@ -159,6 +252,7 @@ class StepManager:
             f"Subprocedure '{section_title}' completed. "
             "Confirm before moving to the next subprocedure"
         )
+        self._flush_state()  # a finished subprocedure is a natural recovery point
 
     # -------------------------
     # Individual step
@@ -169,21 +263,21 @@ class StepManager:
         tips_notes = step.get("tips_notes", [])
         hyperlinks = step.get("hyperlinks", [])
 
-        print("\n" + "=" * 30)
-        print(f"Step {step_number}")
-        print(instruction)
+        lines = ["\n" + "=" * 30, f"Step {step_number}", instruction]
 
         if tips_notes:
-            print("\nNotes / Tips:")
+            lines.append("\nNotes / Tips:")
             for note in tips_notes:
                 content = note.get("content")
                 if content:
-                    print("-", content)
+                    lines.append(f"- {content}")
 
         if hyperlinks:
-            print("\nRelated Links:")
+            lines.append("\nRelated Links:")
             for link in hyperlinks:
-                print(f"- {link['text']}: {link['url']}")
+                lines.append(f"- {link['text']}: {link['url']}")
+
+        self._write_block(lines)
 
         self._require_yes(f"Finished step {step_number}")
 
@@ -192,20 +286,39 @@ class StepManager:
 # Startup / Save selection
 # ==========================
 
-def select_startup_option(input_handler: UserInputHandler) -> Optional[StepManager]:
-    saves = list(Path(SAVE_DIR).glob("*.json"))
+def _read_save(entry: os.DirEntry) -> Optional[dict]:
+    """
+    Parses one save file; None if it is unreadable.
+    """
+    try:
+        return load_json(entry.path)
+    except Exception:
+        return None
+
+
+def select_startup_option(
+    input_handler: UserInputHandler,
+    retriever: ProcedureRetriever,
+) -> Optional[StepManager]:
+    # One directory read, then overlap the per-file reads
+    saves = sorted(
+        (e for e in os.scandir(SAVE_DIR) if e.name.endswith(".json")),
+        key=lambda e: e.name,
+    )
+    with ThreadPoolExecutor(max_workers=SAVE_READ_WORKERS) as executor:
+        states = list(executor.map(_read_save, saves))
+
     if saves:
         print("\nSaved procedures found:")
-        for i, s in enumerate(saves, 1):
-            # Load the save to show step number
-            try:
-                with open(s, "r", encoding="utf-8") as f:
-                    state = json.load(f)
+        for i, (s, state) in enumerate(zip(saves, states), 1):
+            # Show the step number from the save
+            stem = Path(s.name).stem
+            if state:
                 step_num = state.get("step_idx", 0) + 1  # Display next step
-                title = state.get("procedure_title", s.stem)
-            except Exception:
+                title = state.get("procedure_title", stem)
+            else:
                 step_num = 0
-                title = s.stem
+                title = stem
             print(f"{i}. {title} - step {step_num}")
 
         print(f"{len(saves)+1}. Start a new procedure")
@@ -218,13 +331,13 @@ def select_startup_option(input_handler: UserInputHandler) -> Optional[StepManag
             choice_idx = len(saves)  # new procedure
 
         if 0 <= choice_idx < len(saves):
-            # Load save
-            with open(saves[choice_idx], "r", encoding="utf-8") as f:
-                state = json.load(f)
+            # Reuse the save parsed for the listing
+            state = states[choice_idx]
+            if not state:
+                print("❌ Saved progress is unreadable. Starting new procedure.")
+                return None
 
-            retriever = ProcedureRetriever(input_mode=input_handler.mode)
-            procedures = retriever.procedures
-            procedure = procedures.get(state["procedure_id"])
+            procedure = retriever.procedures.get(state["procedure_id"])
 
             if not procedure:
                 print("❌ Saved procedure not found. Starting new procedure.")
@@ -249,11 +362,13 @@ def select_startup_option(input_handler: UserInputHandler) -> Optional[StepManag
 
 def main():
     input_handler = UserInputHandler(mode="text")
+    # Built once: loads the procedures file for both resume and new runs
+    retriever = ProcedureRetriever(input_mode=input_handler.mode)
 
-    manager = select_startup_option(input_handler)
+    manager = select_startup_option(input_handler, retriever)
     if not manager:
-        # Start new procedure
-        retriever = ProcedureRetriever(input_mode=input_handler.mode)
+        # Start new procedure (keep any text/voice switch made at startup)
+        retriever.input_handler.set_mode(input_handler.mode)
         procedure = retriever.retrieve_procedure()
         if not procedure:
             print("❌ No procedure retrieved. Exiting.")
@@ -1,17 +1,38 @@
-import json
+import argparse
+import asyncio
+import os
 import re
-import time
-from tqdm import tqdm
-from utils import Utils
+from tqdm.asyncio import tqdm
+from utils import Utils, append_ndjson, load_json, ndjson_to_json_array, read_ndjson
 
 # ---------------- Paths ----------------
 INPUT_PATH = "../data/raw/body_panels_procedures.json"      # Raw scraped procedures
 OUTPUT_PATH = "../data/processed/body_panels_procedures_augmented.json"  # Final merged output
+PARTIAL_PATH = "../data/processed/body_panels_procedures_augmented.partial.jsonl"  # Per-record checkpoint
+BATCH_JOB_PATH = "../data/processed/body_panels_procedures_augmented.batch_job.json"  # Pending --batch job
 
 utils_handler = Utils()
 
 # ---------------- Constants ----------------
+CONCURRENCY = 8  # Max Gemini requests in flight (be polite to API)
+REQUESTS_PER_SECOND = 4  # Max Gemini requests started per second (stays under the RPM quota)
+FSYNC_EVERY = 16  # Records between fsyncs of the checkpoint file
 OPERATION_KEYWORDS = ["remove", "install", "replace", "inspect", "tighten", "adjust", "disconnect", "reconnect"]
+# No keyword contains another, so one findall sees every keyword a substring scan would
+OPERATION_PATTERN = re.compile("|".join(OPERATION_KEYWORDS))
+TITLE_PATTERN = re.compile(r"^(.*?)\s*\((.*?)\)\s*$")
+FRT_PATTERN = re.compile(r"[\d.]+")
+STRING_LIST = {"type": "ARRAY", "items": {"type": "STRING"}}
+METADATA_SCHEMA = {  # Structured output: Gemini must return exactly these fields
+    "type": "OBJECT",
+    "properties": {
+        "summary": {"type": "STRING"},
+        "safety_flags": STRING_LIST,
+        "prerequisites": STRING_LIST,
+        "keywords": STRING_LIST,
+    },
+    "required": ["summary", "safety_flags", "prerequisites", "keywords"],
+}
 
 # ---------------- Helpers ----------------
 def parse_frt(frt_value):
@@ -21,7 +42,7 @@ def parse_frt(frt_value):
     try:
         return float(frt_value)
     except ValueError:
-        match = re.search(r"[\d\.]+", frt_value)
+        match = FRT_PATTERN.search(frt_value)
         return float(match.group()) if match else None
 
 def split_target_and_operations(title: str):
@@ -31,11 +52,12 @@ def split_target_and_operations(title: str):
     -> target: "Fem Bracket - LH"
        operation_type: ["remove", "replace"]
     """
-    match = re.match(r"^(.*?)\s*\((.*?)\)\s*$", title)
+    match = TITLE_PATTERN.match(title)
     if match:
         target = match.group(1).strip()
         ops_text = match.group(2).lower()
-        operation_type = [op for op in OPERATION_KEYWORDS if op in ops_text]
+        found = set(OPERATION_PATTERN.findall(ops_text))
+        operation_type = [op for op in OPERATION_KEYWORDS if op in found]
         return target, operation_type
     else:
         # fallback
@@ -59,53 +81,184 @@ def build_prompt(full_text: str) -> str:
     \"\"\"
     """.strip()
 
-# ---------------- Main ----------------
-def main():
-    with open(INPUT_PATH, "r", encoding="utf-8") as f:
-        procedures = json.load(f)
+def load_augmented(path: str, partial_path: str) -> dict:
+    """
+    Gemini metadata from a previous run, keyed by procedure id
+    (including records checkpointed by a run that did not finish).
+    """
+    records = load_json(path) if os.path.exists(path) else []
+    augmented = {proc["id"]: proc["llm_metadata"] for proc in records if proc.get("llm_metadata")}
+    if os.path.exists(partial_path):
+        augmented.update(
+            (proc["id"], proc["llm_metadata"]) for proc in read_ndjson(partial_path) if proc.get("llm_metadata")
+        )
+    return augmented
 
-    merged_procs = []
+class RateLimiter:
+    """
+    Spaces request starts at least 1/rate seconds apart, across all tasks of the event loop.
+    """
+    def __init__(self, rate: float):
+        self._interval = 1 / rate
+        self._next_start = 0.0
 
-    for proc in tqdm(procedures, desc="Processing procedures"):
+    async def wait(self):
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next_start)
+        self._next_start = start + self._interval  # reserve the slot before sleeping
+        if start > now:
+            await asyncio.sleep(start - now)
 
-        # Skip if no meaningful text
-        full_text = proc.get("full_text", "")
-        if not full_text or len(full_text) < 200:
-            continue
+# ---------------- Augmentation ----------------
+def has_meaningful_text(proc: dict) -> bool:
+    full_text = proc.get("full_text", "")
+    return bool(full_text) and len(full_text) >= 200
+
+def merge_procedure(proc: dict, llm_result: dict) -> dict:
+    """Build the merged record from a scraped procedure and its Gemini metadata."""
+    if not llm_result:
+        llm_result = {}
+
+    # ---------------- Process title ----------------
+    target_part, operation_type = split_target_and_operations(proc.get("title", ""))
+
+    # ---------------- Build merged procedure ----------------
+    merged_proc = proc.copy()
+    merged_proc["frt"] = parse_frt(merged_proc.get("frt"))
+    merged_proc["target_part"] = target_part
+    merged_proc["operation_type"] = operation_type
+
+    # Remove old title & full_text
+    merged_proc.pop("title", None)
+    merged_proc.pop("full_text", None)
+
+    # Attach LLM metadata
+    merged_proc["llm_metadata"] = llm_result
+
+    return merged_proc
+
+async def augment_procedure(proc: dict, semaphore: asyncio.Semaphore, limiter: RateLimiter, use_cache: bool = True):
+    """
+    Query Gemini for one procedure and build its merged record. A failed request
+    (retries exhausted) leaves llm_metadata empty, so the next run retries it.
+    """
+    # Skip if no meaningful text
+    if not has_meaningful_text(proc):
+        return None
+
+    # ---------------- LLM augmentation ----------------
+    prompt = build_prompt(proc["full_text"])
+    async with semaphore:
+        await limiter.wait()
+        try:
+            llm_result = await utils_handler.aquery_gemini(
+                prompt, response_schema=METADATA_SCHEMA, use_cache=use_cache
+            )
+        except Exception as e:
+            print(f"⚠️ Gemini request failed for {proc.get('id')}: {e}")
+            llm_result = None
+    return merge_procedure(proc, llm_result)
+
+async def augment_all(procedures: list, augmented: dict, out, use_cache: bool = True) -> int:
+    """
+    Augment procedures concurrently and append each merged record to out (JSON lines)
+    in input order: a record finished early waits in a small buffer until every record
+    before it is written. Procedures in augmented reuse that Gemini metadata (steps, FRT
+    and specs come from the new scrape). Returns the number of records written.
+    use_cache=False asks Gemini again even for prompts in the response cache.
+    """
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    limiter = RateLimiter(REQUESTS_PER_SECOND)
 
-        # ---------------- LLM augmentation ----------------
-        prompt = build_prompt(full_text)
-        llm_result = utils_handler.query_gemini(prompt)
-        if not llm_result:
-            llm_result = {}
+    async def augment_indexed(index: int, proc: dict):
+        return index, await augment_procedure(proc, semaphore, limiter, use_cache)
 
-        # ---------------- Process title ----------------
-        target_part, operation_type = split_target_and_operations(proc.get("title", ""))
+    finished = {}  # input index -> merged record (None: skipped), until its turn comes
+    next_index = 0
+    written = 0
 
-        # ---------------- Build merged procedure ----------------
-        merged_proc = proc.copy()
-        merged_proc["frt"] = parse_frt(merged_proc.get("frt"))
-        merged_proc["target_part"] = target_part
-        merged_proc["operation_type"] = operation_type
+    def write_ready() -> None:
+        nonlocal next_index, written
+        while next_index < len(procedures):
+            proc = procedures[next_index]
+            if proc.get("id") in augmented:
+                merged_proc = merge_procedure(proc, augmented[proc["id"]])
+            elif next_index in finished:
+                merged_proc = finished.pop(next_index)
+            else:
+                return  # still waiting for Gemini
+            next_index += 1
+            if not merged_proc:
+                continue
+            append_ndjson(out, merged_proc)
+            written += 1
+            if written % FSYNC_EVERY == 0:
+                os.fsync(out.fileno())
 
-        # Remove old title & full_text
-        merged_proc.pop("title", None)
-        merged_proc.pop("full_text", None)
+    write_ready()
+    for task in tqdm.as_completed(
+        [augment_indexed(index, proc) for index, proc in enumerate(procedures)
+         if proc.get("id") not in augmented],
+        desc="Processing procedures"
+    ):
+        index, merged_proc = await task
+        finished[index] = merged_proc
+        write_ready()
 
-        # Attach LLM metadata
-        merged_proc["llm_metadata"] = llm_result
+    os.fsync(out.fileno())
+    return written
+
+def augment_all_batch(procedures: list, augmented: dict, out, use_cache: bool = True) -> int:
+    """
+    Same output as augment_all, but all new procedures go to Gemini as one Batch API job:
+    half the token cost, at the price of waiting (up to 24h) for the job to finish.
+    An interrupted run resumes the job recorded in BATCH_JOB_PATH.
+    """
+    pending = [proc for proc in procedures if proc.get("id") not in augmented and has_meaningful_text(proc)]
+    prompts = {proc["id"]: build_prompt(proc["full_text"]) for proc in pending}
+    results = utils_handler.batch_query_gemini(
+        prompts, response_schema=METADATA_SCHEMA, use_cache=use_cache, job_path=BATCH_JOB_PATH
+    )
+
+    written = 0
+    for proc in procedures:
+        if proc.get("id") in augmented:
+            append_ndjson(out, merge_procedure(proc, augmented[proc["id"]]))
+        elif proc.get("id") in prompts:
+            append_ndjson(out, merge_procedure(proc, results.get(proc["id"])))
+        else:
+            continue
+        written += 1
+
+    os.fsync(out.fileno())
+    return written
+
+# ---------------- Main ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Augment scraped procedures with Gemini metadata.")
+    parser.add_argument("--force", action="store_true",
+                        help="re-augment every procedure, bypassing the output file and the Gemini response cache")
+    parser.add_argument("--batch", action="store_true",
+                        help="submit new procedures as one Gemini Batch API job (cheaper, not interactive)")
+    args = parser.parse_args()
 
-        merged_procs.append(merged_proc)
+    procedures = load_json(INPUT_PATH)
+    augmented = {} if args.force else load_augmented(OUTPUT_PATH, PARTIAL_PATH)
+    print(f"Reusing {len(augmented)} already augmented procedures")
 
-        # Be polite to API
-        time.sleep(1)
+    # Records are streamed to the checkpoint file; a crash keeps everything written so far
+    with open(PARTIAL_PATH, "wb") as out:
+        if args.batch:
+            written = augment_all_batch(procedures, augmented, out, use_cache=not args.force)
+        else:
+            written = asyncio.run(augment_all(procedures, augmented, out, use_cache=not args.force))
 
     # ---------------- Save output ----------------
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(merged_procs, f, indent=2, ensure_ascii=False)
+    ndjson_to_json_array(PARTIAL_PATH, OUTPUT_PATH)
+    os.remove(PARTIAL_PATH)
 
-    print(f"✅ Augmented and merged JSON saved to: {OUTPUT_PATH}")
+    print(f"✅ {written} augmented and merged procedures saved to: {OUTPUT_PATH}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
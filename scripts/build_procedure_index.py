@@ -0,0 +1,116 @@
+"""
+Random-access index for the augmented procedures file.
+
+build: run once after augmentation (python build_procedure_index.py)
+- procedures.bin: every procedure serialized with orjson, back to back
+- procedures.idx.json: procedure id -> [offset, length] in procedures.bin,
+  plus the size/mtime of the source JSON and of procedures.bin so a stale or
+  mismatched index is ignored
+- both files are replaced atomically, so a running reader keeps its old mapping
+
+read: open_procedure_index() mmaps procedures.bin and decodes only the
+procedures that are actually looked up.
+"""
+
+import functools
+import mmap
+import os
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional
+
+import orjson
+
+from utils import dump_json, load_json
+
+SOURCE_PATH = "../data/processed/body_panels_procedures_augmented.json"
+DATA_PATH = "../data/processed/procedures.bin"
+INDEX_PATH = "../data/processed/procedures.idx.json"
+
+
+class ProcedureIndex(Mapping):
+    """
+    Read-only procedure_id -> procedure mapping backed by an mmap of procedures.bin.
+    """
+
+    def __init__(self, data_path: str, offsets: Dict[str, List[int]]):
+        self._offsets = offsets
+        with open(data_path, "rb") as f:
+            self.data_signature = _stat_signature(os.fstat(f.fileno()))
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getitem__(self, proc_id: str) -> dict:
+        offset, length = self._offsets[proc_id]
+        return orjson.loads(self._mm[offset:offset + length])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+
+def _stat_signature(stat: os.stat_result) -> List[int]:
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _file_signature(path: str) -> List[int]:
+    return _stat_signature(os.stat(path))
+
+
+def open_procedure_index(source_path: str = SOURCE_PATH) -> Optional[ProcedureIndex]:
+    """
+    Returns the index for source_path, or None if it is missing or stale.
+    Keyed by the source and index signatures, so a rebuilt index is picked up.
+    """
+    try:
+        source = _file_signature(source_path)
+        index_signature = _file_signature(INDEX_PATH)
+    except OSError:
+        return None
+    return _open_procedure_index_cached(source_path, tuple(source), tuple(index_signature))
+
+
+@functools.lru_cache(maxsize=4)
+def _open_procedure_index_cached(source_path: str, source: tuple, index_signature: tuple) -> Optional[ProcedureIndex]:
+    try:
+        index = load_json(INDEX_PATH)
+        if index.get("source") != list(source):
+            return None
+        procedures = ProcedureIndex(DATA_PATH, index["offsets"])
+        # The index must describe this exact procedures.bin (not one from another build)
+        if procedures.data_signature != index["data"]:
+            return None
+        return procedures
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def main():
+    procedures = load_json(SOURCE_PATH)
+
+    offsets = {}
+    position = 0
+    # New files replace the old ones: a running assistant may have procedures.bin
+    # mmap'd, and truncating it in place would crash that process (SIGBUS)
+    tmp_data_path = f"{DATA_PATH}.tmp"
+    with open(tmp_data_path, "wb") as f:
+        for proc in procedures:
+            blob = orjson.dumps(proc)
+            f.write(blob)
+            offsets[proc["id"]] = [position, len(blob)]
+            position += len(blob)
+    os.replace(tmp_data_path, DATA_PATH)
+
+    tmp_index_path = f"{INDEX_PATH}.tmp"
+    dump_json({
+        "source": _file_signature(SOURCE_PATH),
+        "data": _file_signature(DATA_PATH),
+        "offsets": offsets,
+    }, tmp_index_path)
+    os.replace(tmp_index_path, INDEX_PATH)
+
+    print(f"✅ Indexed {len(offsets)} procedures to {DATA_PATH}")
+
+
+if __name__ == "__main__":
+    main()
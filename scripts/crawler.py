@@ -1,23 +1,45 @@
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin
+from urllib3.util.retry import Retry
 
 BASE = "https://service.tesla.com/docs/ModelY/ServiceManual/2025/en-us/"
+REQUEST_TIMEOUT = 15
+POOL_SIZE = 32
 
-def crawl_body_panels_section(section_url):
+def make_session() -> requests.Session:
+    """
+    Keep-alive session (one TLS handshake per host) that retries
+    429/5xx responses with exponential backoff.
+    """
+    retry = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def crawl_body_panels_section(section_url, session=None):
     print("Starting crawl")
-    res = requests.get(section_url)
-    soup = BeautifulSoup(res.text, "html.parser")
+    session = session or make_session()
+    res = session.get(section_url, timeout=REQUEST_TIMEOUT)
+    res.raise_for_status()
+    soup = BeautifulSoup(res.text, "lxml")
 
     links = []
+    seen = set()
     for a in soup.select("main a"):
         href = a.get("href")
         text = a.get_text(strip=True)
         if href and "GUID" in href :
             # clean up title
-            title_clean = text.split("Correction code")[0].strip()
+            if "Correction code" in text:
+                text = text.split("Correction code")[0]
+            title_clean = text.strip()
             full = urljoin(BASE, href)
-            if full not in [l["url"] for l in links] and title_clean != "10 - Body" and "Remove" in title_clean:
+            if full not in seen and title_clean != "10 - Body" and "Remove" in title_clean:
+                seen.add(full)
                 links.append({
                     "title": title_clean,
                     "url": full
@@ -31,4 +53,3 @@ if __name__ == "__main__":
 
     for link in procedure_links:
         print(link)
-
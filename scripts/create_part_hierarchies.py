@@ -1,5 +1,5 @@
-import json
 import re
+from utils import dump_json, load_json
 
 INPUT_PATH = "../data/raw/body_panels_procedures.json"
 OUTPUT_PATH = "../data/model_parts.json"
@@ -7,6 +7,9 @@ OUTPUT_PATH = "../data/model_parts.json"
 # Expandable list of supported models
 MODELS = ["Model Y"]
 
+ACTION_PATTERN = re.compile(r"\((.*?)\)")
+PAREN_PATTERN = re.compile(r"\(.*?\)")
+
 
 def extract_part_and_action(title: str):
     """
@@ -18,17 +21,16 @@ def extract_part_and_action(title: str):
     if not title:
         return None, None
 
-    action_match = re.search(r"\((.*?)\)", title)
+    action_match = ACTION_PATTERN.search(title)
     action = action_match.group(1).strip() if action_match else None
 
-    part = re.sub(r"\(.*?\)", "", title).strip()
+    part = PAREN_PATTERN.sub("", title).strip()
 
     return part, action
 
 
 def main():
-    with open(INPUT_PATH, "r", encoding="utf-8") as f:
-        procedures = json.load(f)
+    procedures = load_json(INPUT_PATH)
 
     # Initialize output structure
     output = {model: {} for model in MODELS}
@@ -53,8 +55,7 @@ def main():
         if action not in model_parts[part]:
             model_parts[part].append([action, proc.get("id")])
 
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    dump_json(output, OUTPUT_PATH)
 
     print(f"✅ Saved model → parts → actions to {OUTPUT_PATH}")
 
@@ -11,26 +11,123 @@ Responsibilities:
 Phase 2 will extend this with step-level guidance.
 """
 
-import json
+import functools
+import hashlib
 import os
+import re
 from typing import Dict, List, Tuple
-from dotenv import load_dotenv
+import orjson
+from build_procedure_index import open_procedure_index
+from semantic_search import PartMatcher, SemanticPromptCache, embed_texts
 from user_input_handler import UserInputHandler
-from utils import Utils
-
-load_dotenv()
+from utils import CACHE_DIR, JsonDiskCache, Utils, load_json
 
 # =========================
 # Configuration
 # =========================
 
-MODEL_NAME = "gemini-2.5-flash"
+MODEL_NAME = "gemini-2.5-flash-lite"  # picking from a fixed list needs no larger model
+MAX_OUTPUT_TOKENS = 128
 
 MODEL_PARTS_PATH = "../data/model_parts.json"
 PROCEDURES_PATH = "../data/processed/body_panels_procedures_augmented.json"
 
-API_KEY = os.getenv("API_KEY")
 TOP_K = 3
+CANDIDATE_CACHE_TTL = 30 * 24 * 3600  # seconds
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+BIGRAM_MATCH_THRESHOLD = 0.8  # Dice similarity of a part name and the closest stretch of the request
+BIGRAM_MATCH_MARGIN = 0.1  # the best part must beat the runner-up by this much to skip the next layers
+
+
+# =========================
+# JSON Loaders
+# =========================
+
+def _load_json(path: str, by_id: bool = False) -> Dict:
+    """
+    Parses each data file once per process; later retrievers share the result.
+    Keyed by mtime, so an edited file is re-read.
+    """
+    return _load_json_cached(path, os.stat(path).st_mtime_ns, by_id)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_json_cached(path: str, mtime_ns: int, by_id: bool) -> Dict:
+    data = load_json(path)
+    if by_id:
+        return {proc["id"]: proc for proc in data}
+    return data
+
+
+def _candidates_cache_key(user_input: str, valid_parts: List[str]) -> str:
+    """
+    Same request (case/whitespace-insensitive) against the same part list.
+    """
+    parts_digest = hashlib.blake2b(orjson.dumps(valid_parts)).hexdigest()
+    normalized = " ".join(user_input.lower().split())
+    return hashlib.blake2b(f"{normalized}|{parts_digest}".encode(), digest_size=16).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _part_tokens(part: str) -> frozenset:
+    return frozenset(TOKEN_PATTERN.findall(part.lower()))
+
+
+def _literal_part_matches(user_input: str, valid_parts: List[str]) -> List[Dict]:
+    """
+    Parts whose every word appears in the request ("replace the hood" -> Hood,
+    "front lh door" -> Door - Front - LH), most specific first.
+    """
+    request_tokens = set(TOKEN_PATTERN.findall(user_input.lower()))
+    matches = [part for part in valid_parts if _part_tokens(part) and _part_tokens(part) <= request_tokens]
+    matches.sort(key=lambda part: len(_part_tokens(part)), reverse=True)
+    return [{"part": part} for part in matches[:TOP_K]]
+
+
+def _bigrams(words: Tuple[str, ...]) -> frozenset:
+    """
+    Character bigrams of each word padded with spaces, so word starts and ends count
+    ("fender lh" -> " f", fe, en, nd, de, er, "r ", " l", lh, "h ").
+    """
+    return frozenset(pair for word in words for pair in zip(f" {word}", f"{word} "))
+
+
+@functools.lru_cache(maxsize=None)
+def _part_bigrams(part: str) -> Tuple[frozenset, int]:
+    words = tuple(TOKEN_PATTERN.findall(part.lower()))
+    return _bigrams(words), len(words)
+
+
+def _bigram_part_matches(user_input: str, valid_parts: List[str]) -> List[Dict]:
+    """
+    The part whose name is nearly identical to some stretch of the request: catches
+    misspellings ("fendr lh") without loading the embedding model.
+    Each part is compared (Dice similarity) with every run of the request's words about
+    as long as its name, so words missing from either side lower the score. Returns []
+    unless the best part is above BIGRAM_MATCH_THRESHOLD and clearly ahead of the rest.
+    """
+    request_words = tuple(TOKEN_PATTERN.findall(user_input.lower()))
+    windows: Dict[int, List[frozenset]] = {}  # word count -> bigrams of each run of that many words
+    scores = []
+    for part in valid_parts:
+        part_bigrams, word_count = _part_bigrams(part)
+        if not part_bigrams:
+            continue
+        best = 0.0
+        for size in (word_count, word_count + 1):
+            if size not in windows:
+                windows[size] = [_bigrams(request_words[i:i + size])
+                                 for i in range(max(1, len(request_words) - size + 1))]
+            for window in windows[size]:
+                best = max(best, 2 * len(part_bigrams & window) / (len(part_bigrams) + len(window)))
+        scores.append((best, part))
+
+    scores.sort(key=lambda item: item[0], reverse=True)
+    if not scores or scores[0][0] < BIGRAM_MATCH_THRESHOLD:
+        return []
+    if len(scores) > 1 and scores[0][0] - scores[1][0] < BIGRAM_MATCH_MARGIN:
+        return []  # ambiguous: let the embedding match / Gemini rank them
+    return [{"part": scores[0][1]}]
 
 
 # =========================
@@ -41,26 +138,60 @@ class ProcedureRetriever:
     def __init__(self, input_mode: str = "text"):
         self.input_handler = UserInputHandler(mode=input_mode)
         self.utils = Utils()
-        self.model_parts = self._load_json(MODEL_PARTS_PATH)
-        self.procedures = self._load_json(PROCEDURES_PATH, by_id=True)
-
-    # -------------------------
-    # JSON Loaders
-    # -------------------------
-
-    def _load_json(self, path: str, by_id: bool = False) -> Dict:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if by_id:
-            return {proc["id"]: proc for proc in data}
-        return data
+        self.candidate_cache = JsonDiskCache(os.path.join(CACHE_DIR, "candidates"), ttl_seconds=CANDIDATE_CACHE_TTL)
+        self.semantic_caches: Dict[str, SemanticPromptCache] = {}
+        self.part_matchers: Dict[str, PartMatcher] = {}
+        self._embeddings_available = True  # cleared after the first embedding failure
+        self.model_parts = _load_json(MODEL_PARTS_PATH)
+        self.valid_parts = {model: list(parts) for model, parts in self.model_parts.items()}
+        self._part_prompt_prefixes: Dict[str, str] = {}
+        self._candidates_schema_cache: Dict[str, Dict] = {}
+        # Prefer the mmap'd index (decodes only the requested procedure)
+        self.procedures = open_procedure_index(PROCEDURES_PATH) or _load_json(PROCEDURES_PATH, by_id=True)
+
+    def get_procedures_for_part(self, model: str, part: str) -> List[dict]:
+        """
+        The part's procedures, in model_parts order (the same part -> [operation, id]
+        data the operation menu uses).
+        """
+        return [
+            self.procedures[proc_id]
+            for _, proc_id in self.model_parts.get(model, {}).get(part, [])
+            if proc_id in self.procedures
+        ]
 
     # -------------------------
     # Part Candidate Prompt
     # -------------------------
 
-    def _build_part_prompt(self, user_input: str, valid_parts: List[str]) -> str:
-        return f"""
+    def _candidates_schema(self, model: str) -> Dict:
+        """
+        Structured-output schema: at most TOP_K candidates, each part restricted
+        to the model's valid part names.
+        """
+        if model not in self._candidates_schema_cache:
+            part = {"type": "STRING", "enum": sorted(self.valid_parts[model])}
+            self._candidates_schema_cache[model] = {
+                "type": "OBJECT",
+                "properties": {
+                    "candidates": {
+                        "type": "ARRAY",
+                        "max_items": TOP_K,
+                        "items": {"type": "OBJECT", "properties": {"part": part}, "required": ["part"]}
+                    }
+                },
+                "required": ["candidates"]
+            }
+        return self._candidates_schema_cache[model]
+
+    def _part_prompt_prefix(self, model: str) -> str:
+        """
+        Everything in the part prompt except the request, built once per model
+        (sorted part list, so the text is stable across runs).
+        """
+        if model not in self._part_prompt_prefixes:
+            parts_json = orjson.dumps(sorted(self.valid_parts[model]), option=orjson.OPT_INDENT_2).decode()
+            self._part_prompt_prefixes[model] = f"""
         You are matching a technician request to known vehicle parts.
 
         Rules:
@@ -73,39 +204,100 @@ class ProcedureRetriever:
         - Handle synonyms and informal language.
 
         Valid target parts:
-        {json.dumps(valid_parts, indent=2)}
-
-        Technician request:
-        "{user_input}"
+        {parts_json}
 
         Return ONLY valid JSON:
         {{
         "candidates": [
-            {{ "part": "<valid part name>", "confidence": "high | medium | low" }}
+            {{ "part": "<valid part name>" }}
         ]
         }}
-        """.strip()
 
-    def _extract_part_candidates(self, user_input: str, valid_parts: List[str]) -> List[Dict]:
-        prompt = self._build_part_prompt(user_input, valid_parts)
-        result = self.utils.query_gemini(prompt)
-        return result.get("candidates", [])
+        Technician request:
+        """.lstrip()
+        return self._part_prompt_prefixes[model]
+
+    def _build_part_prompt(self, user_input: str, model: str) -> str:
+        # Fixed content first, request last: consecutive calls share a prompt
+        # prefix that Gemini can serve from its implicit cache
+        return f"""{self._part_prompt_prefix(model)}"{user_input}"
+        Return the JSON now."""
+
+    def _extract_part_candidates(self, user_input: str, valid_parts: List[str], model: str) -> List[Dict]:
+        # Exact (normalized) repeat of an earlier request
+        key = _candidates_cache_key(user_input, valid_parts)
+        cached = self.candidate_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Request names the part outright
+        candidates = _literal_part_matches(user_input, valid_parts)
+        if candidates:
+            return candidates
+
+        # Request names the part with small typos
+        candidates = _bigram_part_matches(user_input, valid_parts)
+        if candidates:
+            return candidates
+
+        # Local embedding match, then requests with the same meaning (no API call).
+        # Optional: if the embedding model can't be loaded, Gemini still answers.
+        embedding = None
+        semantic_cache = None
+        if self._embeddings_available:
+            try:
+                if model not in self.part_matchers:
+                    self.part_matchers[model] = PartMatcher(valid_parts)
+                embedding = embed_texts([user_input])[0]
+                candidates = self.part_matchers[model].match(embedding, TOP_K)
+                if candidates is not None:
+                    return candidates
+
+                if model not in self.semantic_caches:
+                    self.semantic_caches[model] = SemanticPromptCache(model, valid_parts)
+                semantic_cache = self.semantic_caches[model]
+                cached = semantic_cache.lookup(embedding)
+                if cached is not None:
+                    return cached
+            except Exception as e:
+                print(f"⚠️ Local part matching unavailable, using Gemini only: {e}")
+                self._embeddings_available = False
+                embedding = None
+                semantic_cache = None
+
+        prompt = self._build_part_prompt(user_input, model)
+        result = self.utils.query_gemini(
+            prompt,
+            response_schema=self._candidates_schema(model),
+            model=MODEL_NAME,
+            max_output_tokens=MAX_OUTPUT_TOKENS,
+            temperature=0.0,
+            use_cache=False  # candidate_cache (with its TTL) already covers repeats
+        )
+        if result is None:
+            return []  # unparseable response: don't cache
+
+        candidates = result.get("candidates", [])
+        self.candidate_cache.set(key, candidates)
+        if semantic_cache is not None:
+            semantic_cache.add(user_input, embedding, candidates)
+        return candidates
 
     # -------------------------
     # Part Selection (Loop + Retry)
     # -------------------------
 
-    def _choose_part(self, initial_input: str, valid_parts: List[str]) -> Tuple[str, List[Dict]]:
+    def _choose_part(self, initial_input: str, valid_parts: List[str], model: str) -> Tuple[str, List[Dict]]:
         user_input = initial_input
         while True:
-            candidates = self._extract_part_candidates(user_input, valid_parts)
+            candidates = self._extract_part_candidates(user_input, valid_parts, model)
 
             if not candidates:
                 print("❌ No matching parts found. You can retry with a new prompt.")
             else:
                 print("\nPossible target parts:")
                 for i, c in enumerate(candidates, 1):
-                    print(f"{i}. {c['part']} (confidence: {c.get('confidence', 'unknown')})")
+                    print(f"{i}. {c['part']}")
 
             try:
                 idx = int(
@@ -131,7 +323,10 @@ class ProcedureRetriever:
     # Operation Selection
     # -------------------------
 
-    def _choose_operation(self, part_data: List[List[str]]) -> str:
+    def _choose_operation(self, part_data: List[List[str]]) -> Tuple[str, str]:
+        """
+        Returns the selected (operation, procedure id) pair.
+        """
         print("\nAvailable operations:")
         for i, (op, _) in enumerate(part_data, 1):
             print(f"{i}. {op}")
@@ -143,13 +338,8 @@ class ProcedureRetriever:
                 max_choice=len(part_data)
             )
         ) - 1
-        return part_data[idx][0]
-
-    def _get_procedure_id(self, part_data: List[List[str]], operation: str) -> str:
-        for op, guid in part_data:
-            if op == operation:
-                return guid
-        return None
+        operation, proc_id = part_data[idx]
+        return operation, proc_id
 
     # -------------------------
     # Feedback Logging
@@ -201,9 +391,9 @@ class ProcedureRetriever:
         print(f"Selected model: {model}")
 
         # Retrieve parts
-        valid_parts = list(self.model_parts[model].keys())
+        valid_parts = self.valid_parts[model]
         user_input = self.input_handler.get_input("\nDescribe what you want to do:")
-        selected_part, candidates = self._choose_part(user_input, valid_parts)
+        selected_part, candidates = self._choose_part(user_input, valid_parts, model)
 
         if not selected_part:
             print("Aborted.")
@@ -211,8 +401,7 @@ class ProcedureRetriever:
 
         # Retrieve operation and procedure
         part_data = self.model_parts[model][selected_part]
-        operation = self._choose_operation(part_data)
-        proc_id = self._get_procedure_id(part_data, operation)
+        operation, proc_id = self._choose_operation(part_data)
         procedure = self.procedures.get(proc_id)
 
         if not assistant_mode:
@@ -1,6 +1,13 @@
+import argparse
+import contextlib
+import os
 import re
-import json
-from bs4 import BeautifulSoup
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import orjson
+from bs4 import BeautifulSoup, NavigableString
 from tqdm import tqdm
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -9,6 +16,8 @@ from chromedriver_py import binary_path
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
+from crawler import REQUEST_TIMEOUT, crawl_body_panels_section, make_session
+from utils import append_ndjson, ndjson_to_json_array, read_ndjson
 
 ROOT_URL = (
     "https://service.tesla.com/docs/ModelY/ServiceManual/2025/en-us/"
@@ -16,26 +25,29 @@ ROOT_URL = (
 )
 
 SAVE_PATH = "../data/raw/body_panels_procedures.json"
-
-TIP_NOTE_PATTERN = re.compile(
-    r'(?:(Tip|TIp|Note|Caution|Warning))\s*(.*?)(?=(?:Tip|TIp|Note|Caution|Warning|$))',
-    re.IGNORECASE | re.DOTALL
+PARTIAL_PATH = "../data/raw/body_panels_procedures.partial.jsonl"  # Per-page checkpoint
+SCRAPE_WORKERS = 4  # headless Chrome instances rendering pages in parallel
+FETCH_WORKERS = 16  # concurrent plain HTTP fetches (default path)
+
+# Labels only: a note runs from its label to the next label (or the end of the step)
+TIP_NOTE_PATTERN = re.compile(r'Tip|Note|Caution|Warning', re.IGNORECASE)
+NOISE_PATTERN = re.compile(
+    r'(Expand All\|Collapse All|Expand All|Collapse All|Informational Purposes|'
+    r'An informational icon|calling your attention|Warning Icon|A warning icon|'
+    r'possibly risky situation)',
+    re.IGNORECASE
 )
+CORRECTION_CODE_PATTERN = re.compile(r"Correction code\s+(\d+)")
+FRT_PATTERN = re.compile(r"FRT\s+([\d.]+)")
+WHITESPACE_PATTERN = re.compile(r"\s+")  # \s matches exactly what str.split() splits on
 
 
 def clean_text(text: str) -> str:
     if not text:
         return ""
 
-    text = re.sub(
-        r'(Expand All\|Collapse All|Expand All|Collapse All|Informational Purposes|'
-        r'An informational icon|calling your attention|Warning Icon|A warning icon|'
-        r'possibly risky situation)',
-        '',
-        text,
-        flags=re.I
-    )
-    return " ".join(text.split()).strip().strip(',')
+    text = NOISE_PATTERN.sub('', text)
+    return WHITESPACE_PATTERN.sub(' ', text).strip().strip(',')
 
 
 def normalize_section_title(raw_title: str) -> str:
@@ -70,9 +82,10 @@ def split_instruction_and_notes(raw_text: str):
     first_match_start = matches[0].start()
     main_instruction = clean_text(raw_text[:first_match_start])
 
-    for m in matches:
-        label = m.group(1).capitalize()
-        content = clean_text(m.group(2))
+    content_ends = [m.start() for m in matches[1:]] + [len(raw_text)]
+    for m, content_end in zip(matches, content_ends):
+        label = m.group().capitalize()
+        content = clean_text(raw_text[m.end():content_end])
         if content:
             tips_notes.append({
                 "type": label,
@@ -83,6 +96,9 @@ def split_instruction_and_notes(raw_text: str):
 
 
 def scrape_procedure(url: str, driver, title: str):
+    """
+    Renders the page in Chrome (for pages that need JavaScript) and parses it.
+    """
     driver.get(url)
     try:
         WebDriverWait(driver, 10).until(
@@ -91,59 +107,126 @@ def scrape_procedure(url: str, driver, title: str):
     except Exception:
         return None
 
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    proc_id = url.split('/')[-1].replace('.html', '')
-
-    full_text_raw = soup.get_text()
-    correction_match = re.search(r"Correction code\s+(\d+)", full_text_raw)
-    frt_match = re.search(r"FRT\s+([\d.]+)", full_text_raw)
+    return parse_procedure(driver.page_source, url, title)
 
-    all_sections = []
-    main_content = soup.find('main') or soup.find('article')
 
-    if main_content:
-        procedure_lists = main_content.find_all(['ol', 'ul'])
+def fetch_page(url: str, session):
+    """
+    Fetches the server-rendered HTML directly (no JavaScript), or None on HTTP errors.
+    """
+    try:
+        res = session.get(url, timeout=REQUEST_TIMEOUT)
+        res.raise_for_status()
+    except Exception as e:
+        print(f"⚠️ Failed to fetch {url}: {e}")
+        return None
+    return res.text
 
-        for p_list in procedure_lists:
-            if p_list.find_parent('table'):
-                continue
 
-            header = p_list.find_previous(['h2', 'h3'])
-            section_name = normalize_section_title(
-                header.get_text() if header else "Procedure"
-            )
+def walk_page(soup):
+    """
+    Single document-order pass over the page collecting what parse_procedure needs:
+    - the page text (same strings as soup.get_text())
+    - whether there is an <h1>
+    - every <ol>/<ul> outside tables, with its preceding <h2>/<h3> and enclosing <main>/<article>
+    - every <table>
+    """
+    text_types = soup.interesting_string_types
+    page = {"text_parts": [], "h1": False, "main": None, "article": None, "lists": [], "tables": []}
+    header = None
+
+    # (node, outermost enclosing main, outermost enclosing article, inside a table)
+    stack = [(soup, None, None, False)]
+    while stack:
+        node, main, article, in_table = stack.pop()
+        if isinstance(node, NavigableString):
+            if type(node) in text_types:
+                page["text_parts"].append(node)
+            continue
+
+        name = node.name
+        if name == "h1":
+            page["h1"] = True
+        elif name in ("h2", "h3"):
+            header = node
+        elif name == "main":
+            main = main or node
+            page["main"] = page["main"] or node
+        elif name == "article":
+            article = article or node
+            page["article"] = page["article"] or node
+        elif name == "table":
+            page["tables"].append(node)
+            in_table = True
+        elif name in ("ol", "ul") and not in_table:
+            page["lists"].append((node, header, main, article))
+
+        stack.extend((child, main, article, in_table) for child in reversed(node.contents))
+
+    return page
+
+
+def parse_procedure(html: str, url: str, title: str, require_content: bool = False):
+    """
+    Returns None if the page has no <h1> (or, with require_content, no <main>/<article>:
+    the HTML was fetched before client-side rendering filled it in).
+    """
+    soup = BeautifulSoup(html, "lxml")
+    page = walk_page(soup)
+    if not page["h1"]:
+        return None
+    if require_content and page["main"] is None and page["article"] is None:
+        return None
 
-            section_steps = []
-            step_counter = 1
+    proc_id = url.split('/')[-1].replace('.html', '')
 
-            for li in p_list.find_all('li', recursive=False):
-                hyperlinks = extract_links_from_li(li)
+    full_text_raw = "".join(page["text_parts"])
+    correction_match = CORRECTION_CODE_PATTERN.search(full_text_raw)
+    frt_match = FRT_PATTERN.search(full_text_raw)
 
-                raw_text = clean_text(li.get_text())
-                instruction, tips_notes = split_instruction_and_notes(raw_text)
+    all_sections = []
+    seen_sections = set()  # (title, serialized steps) of sections already kept
+    # Lists of the first <main> (or, without one, the first <article>)
+    if page["main"] is not None:
+        procedure_lists = [(l, h) for l, h, main, _ in page["lists"] if main is page["main"]]
+    else:
+        procedure_lists = [(l, h) for l, h, _, article in page["lists"]
+                           if article is not None and article is page["article"]]
+
+    for p_list, header in procedure_lists:
+        section_name = normalize_section_title(
+            header.get_text() if header else "Procedure"
+        )
 
-                if instruction:
-                    section_steps.append({
-                        "step_number": step_counter,
-                        "instruction": instruction,
-                        "hyperlinks": hyperlinks,
-                        "tips_notes": tips_notes
-                    })
-                    step_counter += 1
-
-            if len(section_steps) > 1:
-                if not any(
-                    s["section_title"] == section_name and
-                    s["steps"] == section_steps
-                    for s in all_sections
-                ):
-                    all_sections.append({
-                        "section_title": section_name,
-                        "steps": section_steps
-                    })
+        section_steps = []
+        step_counter = 1
+
+        for li in p_list.find_all('li', recursive=False):
+            hyperlinks = extract_links_from_li(li)
+
+            raw_text = clean_text(li.get_text())
+            instruction, tips_notes = split_instruction_and_notes(raw_text)
+
+            if instruction:
+                section_steps.append({
+                    "step_number": step_counter,
+                    "instruction": instruction,
+                    "hyperlinks": hyperlinks,
+                    "tips_notes": tips_notes
+                })
+                step_counter += 1
+
+        if len(section_steps) > 1:
+            signature = (section_name, orjson.dumps(section_steps))
+            if signature not in seen_sections:
+                seen_sections.add(signature)
+                all_sections.append({
+                    "section_title": section_name,
+                    "steps": section_steps
+                })
 
     specs = []
-    for table in soup.find_all('table'):
+    for table in page["tables"]:
         headers = [th.get_text(strip=True).lower() for th in table.find_all('th')]
         if 'torque value' in headers:
             for row in table.find_all('tr')[1:]:
@@ -170,28 +253,152 @@ def scrape_procedure(url: str, driver, title: str):
     }
 
 
-def main():
+def make_driver():
     chrome_options = Options()
     chrome_options.add_argument("--headless=new")
     chrome_options.add_argument("--window-size=1920,1080")
+    # driver.get returns at DOMContentLoaded; scrape_procedure still waits for the <h1>
+    chrome_options.page_load_strategy = "eager"
+    # Images never reach the parsed HTML; JavaScript stays on (it is why Chrome is used)
+    chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
 
     service = Service(executable_path=binary_path)
-    driver = webdriver.Chrome(service=service, options=chrome_options)
+    return webdriver.Chrome(service=service, options=chrome_options)
 
-    from crawler import crawl_body_panels_section
 
-    procedure_links = crawl_body_panels_section(ROOT_URL)
+class DriverPool:
+    """
+    Up to `size` persistent headless Chrome drivers, started on first use
+    and lent to one thread at a time.
+    """
+
+    def __init__(self, size: int = SCRAPE_WORKERS):
+        self._size = size
+        self._idle = queue.Queue()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def driver(self):
+        with self._lock:
+            if self._idle.empty() and len(self._drivers) < self._size:
+                driver = make_driver()
+                self._drivers.append(driver)
+                self._idle.put(driver)
+        driver = self._idle.get()
+        try:
+            yield driver
+        finally:
+            self._idle.put(driver)
+
+    def close(self):
+        for driver in self._drivers:
+            driver.quit()
+        self._drivers.clear()
+
+
+def load_scraped(partial_path: str) -> dict:
+    """
+    Procedures checkpointed by a run that did not finish, keyed by URL.
+    """
+    if not os.path.exists(partial_path):
+        return {}
+    return {proc["full_url"]: proc for proc in read_ndjson(partial_path)}
+
 
-    all_data = []
-    for link in tqdm(procedure_links):
-        data = scrape_procedure(link["url"], driver, title=link["title"])
+def write_results(results, total: int, out) -> int:
+    """
+    Streams the scraped procedures to the checkpoint file as they arrive,
+    skipping pages that yielded nothing. Returns the number written.
+    """
+    written = 0
+    for data in tqdm(results, total=total):
         if data:
-            all_data.append(data)
+            append_ndjson(out, data)
+            written += 1
+    return written
+
+
+def scrape_all(procedure_links, session, out, scraped: dict, workers: int = FETCH_WORKERS) -> int:
+    """
+    Fetches and parses the procedures over a shared keep-alive session.
+    Pages whose HTML lacks the <h1>/<main> are rendered in Chrome instead;
+    a host that has never served a usable static page goes straight to Chrome.
+    Pages already in scraped are reused. Results keep the order of procedure_links.
+    """
+    drivers = DriverPool()
+    host_needs_js = {}  # host -> whether its pages need rendering
+
+    def work(link):
+        url = link["url"]
+        if url in scraped:
+            return scraped[url]
+        host = urlparse(url).netloc
+        if not host_needs_js.get(host, False):
+            html = fetch_page(url, session)
+            if html is None:
+                return None
+            data = parse_procedure(html, url, link["title"], require_content=True)
+            if data is not None:
+                host_needs_js[host] = False
+                return data
+            host_needs_js.setdefault(host, True)
+
+        with drivers.driver() as driver:
+            return scrape_procedure(url, driver, title=link["title"])
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return write_results(pool.map(work, procedure_links), len(procedure_links), out)
+    finally:
+        drivers.close()
 
-    driver.quit()
 
-    with open(SAVE_PATH, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, indent=2, ensure_ascii=False)
+def scrape_all_rendered(procedure_links, out, scraped: dict, workers: int = SCRAPE_WORKERS) -> int:
+    """
+    Scrapes the procedures on a pool of persistent drivers (one page per driver at a time).
+    Pages already in scraped are reused. Results keep the order of procedure_links.
+    """
+    drivers = DriverPool(workers)
+
+    def work(link):
+        if link["url"] in scraped:
+            return scraped[link["url"]]
+        with drivers.driver() as driver:
+            return scrape_procedure(link["url"], driver, title=link["title"])
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return write_results(pool.map(work, procedure_links), len(procedure_links), out)
+    finally:
+        drivers.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape the Body Panels procedures.")
+    parser.add_argument("--js", action="store_true",
+                        help="render every page in headless Chrome instead of fetching the HTML directly")
+    parser.add_argument("--force", action="store_true",
+                        help="re-scrape pages checkpointed by an interrupted run")
+    args = parser.parse_args()
+
+    session = make_session()
+    procedure_links = crawl_body_panels_section(ROOT_URL, session=session)
+    scraped = {} if args.force else load_scraped(PARTIAL_PATH)
+    if scraped:
+        print(f"Reusing {len(scraped)} procedures from an interrupted run")
+
+    # Pages are streamed to the checkpoint file; a crash keeps everything written so far
+    with open(PARTIAL_PATH, "wb") as out:
+        if args.js:
+            written = scrape_all_rendered(procedure_links, out, scraped)
+        else:
+            written = scrape_all(procedure_links, session, out, scraped)
+
+    ndjson_to_json_array(PARTIAL_PATH, SAVE_PATH)
+    os.remove(PARTIAL_PATH)
+
+    print(f"✅ {written} procedures saved to: {SAVE_PATH}")
 
 
 if __name__ == "__main__":
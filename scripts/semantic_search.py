@@ -0,0 +1,153 @@
+"""
+Local sentence embeddings and a semantic cache for Gemini part matching.
+
+- embed_texts: all-MiniLM-L6-v2 (via transformers), mean-pooled and L2-normalized,
+  so a dot product is the cosine similarity
+- PartMatcher: ranks a model's valid parts against a request locally, so most
+  requests never reach Gemini
+- SemanticPromptCache: returns the candidates stored for the most similar earlier
+  request when the similarity clears SIMILARITY_THRESHOLD
+"""
+
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import orjson
+
+from utils import CACHE_DIR, dump_json, load_json
+
+# =========================
+# Configuration
+# =========================
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SIMILARITY_THRESHOLD = 0.92
+LOCAL_MATCH_THRESHOLD = 0.5  # below this the local match is too unsure; ask Gemini
+SEMANTIC_CACHE_DIR = os.path.join(CACHE_DIR, "semantic")
+PART_EMBEDDINGS_DIR = os.path.join(CACHE_DIR, "part_embeddings")
+
+# =========================
+# Embeddings
+# =========================
+
+_tokenizer = None
+_embedding_model = None
+
+def get_embedding_model():
+    global _tokenizer, _embedding_model
+    if _embedding_model is None:
+        from transformers import AutoModel, AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+        _embedding_model = AutoModel.from_pretrained(EMBEDDING_MODEL).eval()
+    return _tokenizer, _embedding_model
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    Returns a (len(texts), dim) float32 matrix of unit-length embeddings.
+    """
+    import torch
+
+    tokenizer, model = get_embedding_model()
+    batch = tokenizer(texts, padding=True, truncation=True, return_tensors="pt")
+    with torch.inference_mode():
+        hidden = model(**batch).last_hidden_state
+    mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+    return torch.nn.functional.normalize(pooled, dim=1).numpy().astype(np.float32)
+
+# =========================
+# Local Part Matching
+# =========================
+
+class PartMatcher:
+    """
+    Cosine nearest-neighbour search over the embedded part names of one model.
+    The part embeddings are saved as <key>.npy, so restarts skip encoding them.
+    """
+
+    def __init__(self, valid_parts: List[str], root: str = PART_EMBEDDINGS_DIR):
+        self._parts = sorted(valid_parts)
+        self._vectors = self._load_or_embed(root) if self._parts else None
+
+    def _load_or_embed(self, root: str) -> np.ndarray:
+        key = hashlib.sha256(orjson.dumps([EMBEDDING_MODEL, self._parts])).hexdigest()[:16]
+        path = os.path.join(root, f"{key}.npy")
+        try:
+            vectors = np.load(path)
+            if len(vectors) == len(self._parts):
+                return vectors
+        except (OSError, ValueError):
+            pass
+
+        vectors = embed_texts(self._parts)
+        os.makedirs(root, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, vectors)
+        os.replace(tmp_path, path)
+        return vectors
+
+    def match(self, embedding: np.ndarray, top_k: int) -> Optional[List[Dict]]:
+        """
+        Up to top_k parts above LOCAL_MATCH_THRESHOLD, best first,
+        or None if not even the best part clears it.
+        """
+        if self._vectors is None:
+            return None
+        scores = self._vectors @ embedding
+        ranked = np.argsort(-scores)[:top_k]
+        if scores[ranked[0]] < LOCAL_MATCH_THRESHOLD:
+            return None
+        return [{"part": self._parts[i]} for i in ranked if scores[i] >= LOCAL_MATCH_THRESHOLD]
+
+# =========================
+# Semantic Cache
+# =========================
+
+class SemanticPromptCache:
+    """
+    Nearest-neighbour cache of part candidates, one store per (model, valid parts)
+    so a changed part list never serves stale results.
+    Persisted as <key>.npy (embeddings) + <key>.json (requests and candidates).
+    """
+
+    def __init__(self, model: str, valid_parts: List[str], root: str = SEMANTIC_CACHE_DIR):
+        key = hashlib.sha256(orjson.dumps([model, sorted(valid_parts)])).hexdigest()[:16]
+        self._vectors_path = os.path.join(root, f"{key}.npy")
+        self._entries_path = os.path.join(root, f"{key}.json")
+        try:
+            vectors = np.load(self._vectors_path)
+            entries = load_json(self._entries_path)
+            # Drop a half-written last entry (crash between the two writes)
+            count = min(len(vectors), len(entries))
+            self._vectors = vectors[:count] if count else None
+            self._entries = entries[:count]
+        except (OSError, ValueError):
+            self._vectors = None
+            self._entries = []
+
+    def lookup(self, embedding: np.ndarray) -> Optional[List[Dict]]:
+        """
+        Candidates of the closest cached request, or None if nothing is close enough.
+        """
+        if self._vectors is None:
+            return None
+        scores = self._vectors @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < SIMILARITY_THRESHOLD:
+            return None
+        return self._entries[best]["candidates"]
+
+    def add(self, user_input: str, embedding: np.ndarray, candidates: List[Dict]) -> None:
+        row = embedding[np.newaxis, :]
+        self._vectors = row if self._vectors is None else np.vstack([self._vectors, row])
+        self._entries.append({"request": user_input, "candidates": candidates})
+
+        os.makedirs(os.path.dirname(self._vectors_path), exist_ok=True)
+        tmp_path = f"{self._vectors_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, self._vectors)
+        os.replace(tmp_path, self._vectors_path)
+        dump_json(self._entries, self._entries_path)
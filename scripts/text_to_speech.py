@@ -1,6 +1,9 @@
+import os
+import threading
 import sounddevice as sd
 import numpy as np
 import re
+import ctranslate2
 from faster_whisper import WhisperModel
 
 # =========================
@@ -8,7 +11,36 @@ from faster_whisper import WhisperModel
 # =========================
 
 SAMPLE_RATE = 16000
+BLOCK_SIZE = 1600  # samples per audio callback (100 ms)
+MAX_RECORD_SECONDS = 300  # recording buffer size; later audio is dropped
 MODEL_SIZE = "small"
+CHOICE_MODEL_SIZE = "tiny.en"  # menu answers are a single English number
+
+NUMBER_WORDS = {
+    "zero": 0,
+    "one": 1,
+    "two": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "eight": 8,
+    "nine": 9,
+    "ten": 10,
+    "eleven": 11,
+    "twelve": 12,
+    "thirteen": 13,
+    "fourteen": 14,
+    "fifteen": 15,
+    "sixteen": 16,
+    "seventeen": 17,
+    "eighteen": 18,
+    "nineteen": 19,
+    "twenty": 20
+}
+NUMBER_WORD_PATTERN = re.compile(r"\b(" + "|".join(NUMBER_WORDS) + r")\b")
+DIGIT_PATTERN = re.compile(r"\b(\d+)\b")
 
 # =========================
 # Recorder
@@ -17,20 +49,27 @@ MODEL_SIZE = "small"
 class Recorder:
     def __init__(self, samplerate=SAMPLE_RATE):
         self.samplerate = samplerate
-        self.frames = []
+        self.buffer = None
+        self.position = 0
         self.recording = False
         self.stream = None
 
     def callback(self, indata, frames, time, status):
         if self.recording:
-            self.frames.append(indata.copy())
+            # Copy straight into the preallocated buffer (no per-block allocation)
+            n = min(frames, len(self.buffer) - self.position)
+            self.buffer[self.position:self.position + n] = indata[:n, 0]
+            self.position += n
 
     def start(self):
-        self.frames = []
+        self.buffer = np.empty(self.samplerate * MAX_RECORD_SECONDS, dtype=np.float32)
+        self.position = 0
         self.recording = True
         self.stream = sd.InputStream(
             samplerate=self.samplerate,
             channels=1,
+            dtype="float32",  # what Whisper takes; blocks are copied without conversion
+            blocksize=BLOCK_SIZE,
             callback=self.callback
         )
         self.stream.start()
@@ -41,29 +80,63 @@ class Recorder:
         self.stream.stop()
         self.stream.close()
 
-        if not self.frames:
+        if not self.position:
             return None
 
-        return np.concatenate(self.frames, axis=0).flatten()
+        return self.buffer[:self.position]
 
 # =========================
 # Whisper
 # =========================
 
-_whisper_model = None
-
-def get_whisper_model():
-    global _whisper_model
-    if _whisper_model is None:
-        _whisper_model = WhisperModel(MODEL_SIZE)
-    return _whisper_model
-
-def transcribe_audio(audio: np.ndarray) -> str:
-    model = get_whisper_model()
-    segments, _ = model.transcribe(audio, beam_size=5)
+_whisper_models = {}
+_whisper_locks = {}  # one per model size: loading "small" never blocks a loaded tiny.en
+
+def get_whisper_model(model_size: str = MODEL_SIZE):
+    model = _whisper_models.get(model_size)
+    if model is not None:
+        return model
+    with _whisper_locks.setdefault(model_size, threading.Lock()):
+        if model_size not in _whisper_models:
+            # int8 weights (int8/fp16 on GPU): about half the latency of the fp32 default
+            if ctranslate2.get_cuda_device_count():
+                model = WhisperModel(model_size, device="cuda", compute_type="int8_float16")
+            else:
+                model = WhisperModel(model_size, device="cpu", compute_type="int8",
+                                     cpu_threads=os.cpu_count() or 0)
+            # Warm-up on 1 s of silence so the first real request doesn't pay for initialization
+            segments, _ = model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+            list(segments)
+            _whisper_models[model_size] = model
+    return _whisper_models[model_size]
+
+def _load_whisper_models():
+    get_whisper_model(CHOICE_MODEL_SIZE)
+    get_whisper_model(MODEL_SIZE)
+
+def preload_whisper_model():
+    """
+    Loads and warms up the models in the background, while the user is still typing or talking.
+    """
+    threading.Thread(target=_load_whisper_models, daemon=True).start()
+
+def transcribe_audio(audio: np.ndarray, expect_choice: bool = False) -> str:
+    if expect_choice:
+        # Greedy decode with the tiny model: plenty for "three" or "12"
+        model = get_whisper_model(CHOICE_MODEL_SIZE)
+        segments, _ = model.transcribe(
+            audio,
+            beam_size=1,
+            best_of=1,
+            without_timestamps=True,
+            condition_on_previous_text=False
+        )
+    else:
+        model = get_whisper_model()
+        segments, _ = model.transcribe(audio, beam_size=5)
     return " ".join(seg.text.strip() for seg in segments).strip()
 
-def record_and_transcribe() -> str:
+def record_and_transcribe(expect_choice: bool = False) -> str:
     recorder = Recorder()
 
     input("🎤 Voice input selected. Press ENTER to start...")
@@ -74,37 +147,12 @@ def record_and_transcribe() -> str:
     if audio is None:
         return ""
 
-    return transcribe_audio(audio)
+    return transcribe_audio(audio, expect_choice)
 
 # =========================
 # Choice Parsing
 # =========================
 
-def get_number_words():
-    return {
-        "zero": 0,
-        "one": 1,
-        "two": 2,
-        "three": 3,
-        "four": 4,
-        "five": 5,
-        "six": 6,
-        "seven": 7,
-        "eight": 8,
-        "nine": 9,
-        "ten": 10,
-        "eleven": 11,
-        "twelve": 12,
-        "thirteen": 13,
-        "fourteen": 14,
-        "fifteen": 15,
-        "sixteen": 16,
-        "seventeen": 17,
-        "eighteen": 18,
-        "nineteen": 19,
-        "twenty": 20
-    }
-
 def parse_choice(text: str):
     if not text:
         return None
@@ -112,13 +160,13 @@ def parse_choice(text: str):
     text = text.lower()
 
     # numeric digit
-    digit_match = re.search(r"\b(\d+)\b", text)
+    digit_match = DIGIT_PATTERN.search(text)
     if digit_match:
         return int(digit_match.group(1))
 
-    # number words
-    for word, value in get_number_words().items():
-        if word in text:
-            return value
+    # number words (whole words only: "seventeen" is not "seven")
+    word_match = NUMBER_WORD_PATTERN.search(text)
+    if word_match:
+        return NUMBER_WORDS[word_match.group(1)]
 
-    return None
\ No newline at end of file
+    return None
@@ -1,4 +1,4 @@
-from text_to_speech import record_and_transcribe, parse_choice
+from text_to_speech import preload_whisper_model, record_and_transcribe, parse_choice
 
 class UserInputHandler:
     """
@@ -11,9 +11,13 @@ class UserInputHandler:
         mode: "text" or "voice"
         """
         self.mode = mode
+        if mode == "voice":
+            preload_whisper_model()
 
     def set_mode(self, mode: str):
         if mode in ["text", "voice"]:
+            if mode == "voice" and self.mode != "voice":
+                preload_whisper_model()
             self.mode = mode
 
     def get_input(self, prompt: str, expect_choice=False, max_choice=None) -> str:
@@ -38,7 +42,7 @@ class UserInputHandler:
         # -------------------------
         # VOICE MODE
         # -------------------------
-        transcript = record_and_transcribe()
+        transcript = record_and_transcribe(expect_choice)
 
         if not transcript:
             print("⚠️ No speech detected → switching to TEXT")
@@ -1,66 +1,477 @@
+import atexit
 import os
-import re
-import json
+import hashlib
+import mmap
+import queue
+import threading
+import time
 import uuid
 from datetime import datetime, UTC
-from typing import Dict
-from google import genai
-from dotenv import load_dotenv
-load_dotenv()
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+import orjson
+
+if "API_KEY" not in os.environ:
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # =========================
 INPUT_PATH = "../data/raw/body_panels_procedures.json"
 OUTPUT_PATH = "../data/processed/body_panels_procedures_augmented.json"
 LOG_DIR = "../logs"
+CACHE_DIR = os.path.join(LOG_DIR, "gemini_cache")
+# Keep Gemini connections warm between calls (skips repeated TLS handshakes)
+GEMINI_MAX_CONNECTIONS = 32
+GEMINI_KEEPALIVE_EXPIRY = 60  # seconds
 API_KEY = os.getenv("API_KEY")
+GEMINI_MODEL = "gemini-2.5-flash"
+PROMPT_CACHE_VERSION = "v1"  # bump to invalidate cached Gemini responses
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # seconds; older cached Gemini responses are asked again
+LOG_ROTATE_BYTES = 50 * 1024 * 1024  # start a new log file past this size
+LOG_BATCH_SIZE = 32  # most queued log records written in one go
+LOG_TIMESTAMP_FORMAT = "%Y-%m-%dT%H-%M-%SZ"
+BATCH_POLL_INTERVAL = 60  # seconds between Batch API status checks
+BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED", "JOB_STATE_FAILED",
+                     "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+BATCH_RESULT_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"}
 # =========================
-    
+
+# Interaction logs are queued and written off the CLI thread; one daemon worker
+# keeps them in order and owns the open log files (append-only NDJSON, one per stage and outcome)
+_log_queue: "queue.Queue[Tuple[str, Dict]]" = queue.Queue()
+_log_worker: Optional[threading.Thread] = None
+_log_worker_lock = threading.Lock()
+_log_files: Dict[str, BinaryIO] = {}
+_log_timestamp: Tuple[int, str] = (-1, "")  # (epoch second, formatted)
+
+
+def load_json(path: str) -> Any:
+    """
+    Parses a JSON file with orjson straight from a read-only mmap,
+    skipping the intermediate str copy of the whole file.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                return orjson.loads(view)
+
+
+def dump_json(data: Any, path: str) -> None:
+    """
+    Writes data as 2-space indented UTF-8 JSON
+    (same layout as json.dump(indent=2, ensure_ascii=False)).
+    """
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+
+def append_ndjson(f: BinaryIO, record: Any) -> None:
+    """
+    Appends one record as a JSON line and flushes it to the OS.
+    """
+    f.write(orjson.dumps(record) + b"\n")
+    f.flush()
+
+
+def read_ndjson(path: str) -> Iterator[Any]:
+    """
+    Yields the records of a JSON-lines file; a truncated last line
+    (interrupted writer) is skipped.
+    """
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                yield orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+
+
+def ndjson_to_json_array(ndjson_path: str, output_path: str) -> None:
+    """
+    Streams a JSON-lines file into a 2-space indented JSON array (same layout
+    as dump_json), one record in memory at a time; the output is replaced atomically.
+    """
+    tmp_path = f"{output_path}.tmp"
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(b"[")
+        for record in read_ndjson(ndjson_path):
+            blob = orjson.dumps(record, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            f.write(b",\n  " if count else b"\n  ")
+            f.write(blob.replace(b"\n", b"\n  "))
+            count += 1
+        f.write(b"\n]" if count else b"]")
+    os.replace(tmp_path, output_path)
+
+
+class JsonDiskCache:
+    """
+    Persistent JSON cache: one file per key under <root>/<key[:2]>/, written
+    atomically, with an in-process dict in front for hot keys.
+    Entries older than ttl_seconds are treated as misses.
+    """
+    def __init__(self, root: str = CACHE_DIR, ttl_seconds: Optional[float] = None):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self._memory: Dict[str, Any] = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Any:
+        """
+        Returns the cached value, or None on a miss.
+        """
+        if key in self._memory:
+            return self._memory[key]
+        path = self._path(key)
+        try:
+            if self.ttl_seconds is not None and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+            value = load_json(path)
+        except (OSError, ValueError):
+            return None
+        self._memory[key] = value
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._memory[key] = value
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(value))
+        os.replace(tmp_path, path)
+
+
+def prompt_cache_key(*parts: str) -> str:
+    """
+    sha256 over 8-byte length-prefixed parts, so ("ab", "c") and ("a", "bc")
+    never hash to the same key.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part.encode()
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+_gemini_client = None
+
+def get_gemini_client():
+    """
+    One process-wide Gemini client, so every Utils instance shares its pooled connections.
+    google-genai is imported here, on first use: cache hits and local-only paths never pay for it.
+    """
+    global _gemini_client
+    if _gemini_client is None:
+        import httpx
+        from google import genai
+        from google.genai import types
+
+        limits = httpx.Limits(
+            max_connections=GEMINI_MAX_CONNECTIONS,
+            max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+            keepalive_expiry=GEMINI_KEEPALIVE_EXPIRY,
+        )
+        _gemini_client = genai.Client(
+            api_key=API_KEY,
+            http_options=types.HttpOptions(
+                client_args={"limits": limits},
+                async_client_args={"limits": limits},
+                retry_options=types.HttpRetryOptions(attempts=3),
+            ),
+        )
+    return _gemini_client
+
 
 class Utils:
     """
     General utility functions like querying the Gemini or saving logs.
     """
     def __init__(self):
-        self._client = genai.Client(api_key=API_KEY)
+        self._response_cache = JsonDiskCache(os.path.join(CACHE_DIR, "responses"), ttl_seconds=RESPONSE_CACHE_TTL)
+
+    @property
+    def _client(self):
+        return get_gemini_client()
 
-    def query_gemini(self, prompt: str) -> dict:
+    def query_gemini(
+        self,
+        prompt: str,
+        response_schema: Optional[Dict] = None,
+        model: str = GEMINI_MODEL,
+        max_output_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        use_cache: bool = True,
+    ) -> dict:
         """
-        Sends the prompt to Gemini and parses JSON response.
+        Sends the prompt to Gemini in JSON mode and parses the response.
+        An optional response_schema (OpenAPI-style dict) constrains the output (e.g. to an enum of valid values);
+        model / max_output_tokens / temperature let small classification calls use a lighter setup.
+        Byte-identical requests are answered from the response cache (for RESPONSE_CACHE_TTL);
+        use_cache=False always asks Gemini (the fresh response still replaces the cached one).
         """
-        def strip_json_fences(text: str) -> str:
-            fence_pattern = r"```(?:json)?\s*(.*?)\s*```"
-            match = re.search(fence_pattern, text, flags=re.DOTALL | re.IGNORECASE)
-            return match.group(1).strip() if match else text.strip()
+        key = self._request_cache_key(prompt, model, response_schema, max_output_tokens, temperature)
+        cached = self._response_cache.get(key) if use_cache else None
+        if cached is not None:
+            return cached
 
-        
         response = self._client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
+            model=model,
+            contents=prompt,
+            config=self._json_config(response_schema, max_output_tokens, temperature)
         )
-        cleaned_text = strip_json_fences(response.text)
+        return self._cache_response(key, response.text)
+
+    async def aquery_gemini(self, prompt: str, response_schema: Optional[Dict] = None, use_cache: bool = True) -> dict:
+        """
+        Async variant of query_gemini, so many prompts can be in flight at once.
+        """
+        key = self._request_cache_key(prompt, GEMINI_MODEL, response_schema)
+        cached = self._response_cache.get(key) if use_cache else None
+        if cached is not None:
+            return cached
+
+        response = await self._client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=self._json_config(response_schema)
+        )
+        return self._cache_response(key, response.text)
+
+    def batch_query_gemini(
+        self,
+        prompts: Dict[str, str],
+        response_schema: Optional[Dict] = None,
+        use_cache: bool = True,
+        job_path: Optional[str] = None,
+    ) -> Dict[str, dict]:
+        """
+        Runs many prompts as a single Gemini Batch API job (half the price, finishes within 24h).
+        prompts maps a caller-chosen name to its prompt; returns name -> parsed response
+        for every prompt that succeeded. Shares the response cache (and use_cache) with query_gemini.
+        With job_path, the submitted job is recorded there until it finishes: a rerun with
+        the same requests resumes polling that job instead of submitting (and paying for) a new one.
+        """
+        results = {}
+        cache_keys = {}
+        for name, prompt in prompts.items():
+            key = self._request_cache_key(prompt, GEMINI_MODEL, response_schema)
+            cached = self._response_cache.get(key) if use_cache else None
+            if cached is not None:
+                results[name] = cached
+            else:
+                cache_keys[name] = key
+        if not cache_keys:
+            return results
+
+        # Result lines are keyed by name, so a job is reusable only for the same name -> request pairs
+        requests_digest = hashlib.sha256(orjson.dumps(sorted(cache_keys.items()))).hexdigest()
+        job = self._resume_batch_job(job_path, requests_digest) if job_path else None
+        if job is None:
+            job = self._submit_batch_job(prompts, cache_keys, response_schema)
+            if job_path:
+                dump_json({"job": job.name, "requests": requests_digest}, job_path)
+
+        while job.state.name not in BATCH_DONE_STATES:
+            time.sleep(BATCH_POLL_INTERVAL)
+            job = self._client.batches.get(name=job.name)
+            print(f"Batch job {job.name}: {job.state.name}")
+
+        if job.dest is None or not job.dest.file_name:
+            print("⚠️ Batch job returned no results:", job.error)
+            if job_path:
+                os.remove(job_path)
+            return results
+
+        for line in self._client.files.download(file=job.dest.file_name).splitlines():
+            record = orjson.loads(line)
+            name = record.get("key")
+            if name not in cache_keys:
+                print("⚠️ Unexpected batch result key:", name)
+                continue
+            try:
+                text = record["response"]["candidates"][0]["content"]["parts"][0]["text"]
+            except (KeyError, IndexError, TypeError):
+                print(f"⚠️ No batch response for {name}:", record.get("error"))
+                continue
+            result = self._cache_response(cache_keys[name], text)
+            if result is not None:
+                results[name] = result
+        if job_path:
+            os.remove(job_path)  # results are in the response cache now
+        return results
+
+    def _resume_batch_job(self, job_path: str, requests_digest: str):
+        """
+        The job recorded at job_path if it was submitted for the same requests
+        and can still deliver results; None otherwise.
+        """
+        try:
+            saved = load_json(job_path)
+        except (OSError, ValueError):
+            return None
+        if saved.get("requests") != requests_digest:
+            return None
+        job = self._client.batches.get(name=saved["job"])
+        if job.state.name in BATCH_DONE_STATES - BATCH_RESULT_STATES:
+            return None  # failed / cancelled / expired: submit again
+        print(f"Resuming batch job {job.name} ({job.state.name})")
+        return job
+
+    def _submit_batch_job(self, prompts: Dict[str, str], cache_keys: Dict[str, str], response_schema: Optional[Dict]):
+        # One JSONL line per request, in the REST GenerateContentRequest format
+        generation_config = {"response_mime_type": "application/json", "candidate_count": 1}
+        if response_schema is not None:
+            generation_config["response_schema"] = response_schema
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        requests_path = os.path.join(CACHE_DIR, f"batch_{uuid.uuid4()}.jsonl")
+        with open(requests_path, "wb") as f:
+            for name in cache_keys:
+                append_ndjson(f, {
+                    "key": name,
+                    "request": {
+                        "contents": [{"role": "user", "parts": [{"text": prompts[name]}]}],
+                        "generation_config": generation_config,
+                    },
+                })
+
+        try:
+            uploaded = self._client.files.upload(file=requests_path, config={"mime_type": "jsonl"})
+        finally:
+            os.remove(requests_path)
+        job = self._client.batches.create(model=GEMINI_MODEL, src=uploaded.name)
+        print(f"Submitted batch job {job.name} ({len(cache_keys)} requests)")
+        return job
+
+    @staticmethod
+    def _json_config(
+        response_schema: Optional[Dict],
+        max_output_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ):
+        from google.genai import types
+
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=response_schema,
+            max_output_tokens=max_output_tokens,
+            temperature=temperature,
+            candidate_count=1
+        )
+
+    @staticmethod
+    def _request_cache_key(
+        prompt: str,
+        model: str,
+        response_schema: Optional[Dict],
+        max_output_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
+        # Built from the plain arguments, so a cache hit never imports google-genai
+        config = orjson.dumps([response_schema, max_output_tokens, temperature], option=orjson.OPT_SORT_KEYS)
+        return prompt_cache_key(PROMPT_CACHE_VERSION, model, prompt, config.decode())
+
+    def _cache_response(self, key: str, text: Optional[str]) -> dict:
+        result = self._parse_response(text)
+        if result is not None:
+            self._response_cache.set(key, result)
+        return result
+
+    def _parse_response(self, text: Optional[str]) -> dict:
+        """
+        Parses the JSON payload. JSON mode means no fences to strip, but a blocked
+        or truncated (max tokens) response can still be empty or incomplete.
+        """
         try:
-            return json.loads(cleaned_text)
-        except json.JSONDecodeError:
-            print("⚠️ Failed to parse Gemini response:", cleaned_text)
+            return orjson.loads(text or "")
+        except orjson.JSONDecodeError:
+            print("⚠️ Failed to parse Gemini response:", text)
             return None
 
     def save_log(self, log_data: Dict, error: bool = False, run_stage: str = None) -> None:
         """
-        Saves log data to a timestamped JSON file.
+        Appends log data as one line to <stage>/{normal,errors}.ndjson.
+        The write happens on a background thread; pending logs are flushed at exit.
         """
         path = os.path.join(LOG_DIR, run_stage) # subdir for stage of the logging
-        if error:
-            path = os.path.join(path, "errors") # change the path to error subdir
-        else:
-            path = os.path.join(path, "normal")
-
-        os.makedirs(LOG_DIR, exist_ok=True)
-        timestamp = datetime.now(UTC).strftime("%Y-%m-%dT%H-%M-%SZ")
-        log_id = str(uuid.uuid4())
-        filename = f"{timestamp}_{log_id}.json"
-        path = os.path.join(path, filename)
-
-        log_data["log_id"] = log_id
-        log_data["timestamp"] = timestamp    
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(log_data, f, indent=2, ensure_ascii=False)
+        path = os.path.join(path, "errors.ndjson" if error else "normal.ndjson")
+
+        log_data["log_id"] = str(uuid.uuid4())
+        log_data["timestamp"] = _utc_timestamp()
+        _start_log_worker()
+        _log_queue.put((path, log_data))
+
+
+def _utc_timestamp() -> str:
+    """
+    Current UTC time in LOG_TIMESTAMP_FORMAT. The format has one-second
+    resolution, so it is formatted at most once per second.
+    """
+    global _log_timestamp
+    now = int(time.time())
+    second, text = _log_timestamp
+    if second != now:
+        text = datetime.fromtimestamp(now, UTC).strftime(LOG_TIMESTAMP_FORMAT)
+        _log_timestamp = (now, text)
+    return text
+
+
+def _start_log_worker() -> None:
+    global _log_worker
+    with _log_worker_lock:
+        if _log_worker is None:
+            _log_worker = threading.Thread(target=_drain_log_queue, name="log-writer", daemon=True)
+            _log_worker.start()
+
+
+def _drain_log_queue() -> None:
+    while True:
+        # Block for one record, then take whatever else has piled up meanwhile
+        batch = [_log_queue.get()]
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _write_logs(batch)
+        except Exception as e:
+            print("⚠️ Failed to write log:", e)
+        finally:
+            for _ in batch:
+                _log_queue.task_done()
+
+
+def _write_logs(batch: List[Tuple[str, Dict]]) -> None:
+    lines_by_path: Dict[str, List[bytes]] = {}
+    for path, log_data in batch:
+        lines_by_path.setdefault(path, []).append(orjson.dumps(log_data) + b"\n")
+    for path, lines in lines_by_path.items():
+        f = _log_file(path)
+        f.write(b"".join(lines))
+        f.flush()  # one write per batch and file
+
+
+def _log_file(path: str) -> BinaryIO:
+    f = _log_files.get(path)
+    if f is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = _log_files[path] = open(path, "ab", buffering=64 * 1024)
+    elif f.tell() > LOG_ROTATE_BYTES:
+        f.close()
+        stem, ext = os.path.splitext(path)
+        os.replace(path, f"{stem}.{_utc_timestamp()}{ext}")
+        f = _log_files[path] = open(path, "ab", buffering=64 * 1024)
+    return f
+
+
+@atexit.register
+def _close_log_files() -> None:
+    # The worker is a daemon thread: wait for it to write everything queued
+    _log_queue.join()
+    for f in _log_files.values():
+        f.close()
+    _log_files.clear()
+